@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+
+import argparse
+import socket
+import threading
+import json
+import heapq
+from datetime import datetime, timedelta
+
+from com import Listener, BatchListener, Sender, PING_TIME, TIMEOUT, DATAGRAM_SIZE
+from diag import Diagnostics
+import controller as ctl
+
+ROOT_LOG_FILE = "Root.log"
+AREA_LOG_FILE = "area#.log"
+
+# collects the areas from an area file where every line is
+# <Area ID> <Switch ID> <Switch ID> ... <Switch ID>
+def read_areas(f_name):
+    areas = {}
+    for line in open(f_name, 'r'):
+        ids = list(map(int, line.split()))
+        if ids:
+            areas[ids[0]] = ids[1:]
+    return areas
+
+# splits the full config into the config of a single area
+# the links leaving the area are returned as [<Switch ID>, <Foreign ID>, <Distance>]
+def area_config(cfg, members):
+    members = set(members)
+    edges   = [e for e in cfg.get('edges') if e[0] in members and e[1] in members]
+    border  = [e if e[0] in members else [e[1], e[0], e[2]]
+               for e in cfg.get('edges') if (e[0] in members) != (e[1] in members)]
+    return {'num_switches':len(members), 'edges':edges}, border
+
+"""
+The AreaController class is a Controller that only owns the switches of one area. Routes inside
+the area are computed as usual, while the links leaving the area are summarized for the root
+controller. The root answers with the cost from each border switch to every foreign destination,
+which the area stitches onto its intra area routes.
+Usage:
+- Initialize with the area id, the full config, the areas, the root (host, port) and a sender.
+- Run it like a Controller, calling send_summary() whenever summary_is_due().
+- Pass the 'area_routes' messages from the root to handle_area_routes().
+"""
+class AreaController(ctl.Controller):
+    def __init__(self, area_id, cfg, areas, root, sender, latency_weight=0.0):
+        area_cfg, border = area_config(cfg, areas[area_id])
+        super().__init__(area_cfg, sender, latency_weight)
+        self.area_id = area_id
+        self.members = set(areas[area_id])
+        for sw_id in self.members:
+            self.map.setdefault(sw_id, {})
+        # configured links out of the area, only those its switch reports alive are in border_map
+        self.bootstrapped_border_map = {}
+        for sw_id, nb_id, dist in border:
+            self.bootstrapped_border_map.setdefault(sw_id, {})[nb_id] = dist
+        self.border_map = {}
+        self.root = root
+        self.area_routes       = {}     # {<Border_ID>: {<Dest_ID>: (<Via_ID>, <Distance>)}}
+        self.foreign_dests     = set()
+        self.foreign_addresses = {}     # {<Foreign_ID>: (<Host>, <Port>)}
+        self.summary       = None
+        self.summary_dirty = True
+        self.summary_age   = datetime.min
+        self.summary_delta = timedelta(seconds=PING_TIME)
+        self.log_file_name = AREA_LOG_FILE.replace('#', str(area_id))
+
+    def register_table(self, switch_id):
+        table = super().register_table(switch_id)
+        for nb_id in self.bootstrapped_border_map.get(switch_id, {}):
+            if nb_id in self.foreign_addresses:
+                table.append((nb_id, *self.foreign_addresses[nb_id]))
+        return table
+
+    def calc_routing_table_djk(self):
+        super().calc_routing_table_djk()
+        self.summary_dirty = True
+        # stitch foreign destinations onto the intra area routes by going through
+        # the border switch with the lowest total distance
+        # unreachable destinations are left out, their rows (i.e. the 9999 row a
+        # start gets for itself after a partition) would hide the real ones
+        local = {start: {dest: (next_hop, dist) for dest, next_hop, dist in row if dist < self._djk_max}
+                 for start, row in self.routing_table.items()}
+        for start in self.routing_table:
+            for dest in self.foreign_dests:
+                best = (-1, self._djk_max)
+                for border_id, routes in self.area_routes.items():
+                    if dest not in routes or border_id not in local[start]:
+                        continue
+                    via, dist = routes[dest]
+                    dist += local[start][border_id][1]
+                    if dist >= best[1]:
+                        continue
+                    if start != border_id:
+                        next_hop = local[start][border_id][0]
+                    elif via in local[start]:
+                        next_hop = local[start][via][0]
+                    elif via in self.members:
+                        # the root has not seen the partition yet
+                        continue
+                    else:
+                        next_hop = via
+                    best = (next_hop, dist)
+                self.routing_table[start].append((dest, *best))
+
+    def handle_register_request(self, host, port, switch_id):
+        assert self.lock.locked()
+        if switch_id not in self.members:
+            raise Exception(f'switch {switch_id} is not part of area {self.area_id}')
+        self.border_map[switch_id] = {}
+        self.summary_dirty = True
+        super().handle_register_request(host, port, switch_id)
+
+    # a border link is alive while its switch reports the foreign neighbor, links the switch
+    # has not reached yet (i.e. before the root sent the address) are not counted as dead
+    def handle_topology_update(self, top_update, rtts=None):
+        assert self.lock.locked()
+        sw_id = list(top_update.keys())[0]
+        if int(sw_id) in self.registery:
+            links = self.border_map.setdefault(int(sw_id), {})
+            for link_id, dist in self.bootstrapped_border_map.get(int(sw_id), {}).items():
+                if link_id in top_update[sw_id] and link_id not in links:
+                    self.summary_dirty = True
+                    links[link_id] = dist
+                    print(f'border link alive {sw_id}->{link_id}')
+                elif link_id not in top_update[sw_id] and link_id in links:
+                    self.summary_dirty = True
+                    self.log_topology_update_link_dead(sw_id, link_id)
+                    links.pop(link_id)
+                    print(f'border link dead {sw_id}->{link_id}')
+        super().handle_topology_update(top_update, rtts)
+
+    def handle_switch_dead(self, sw_id):
+        assert self.lock.locked()
+        self.border_map.pop(sw_id, None)
+        self.summary_dirty = True
+        super().handle_switch_dead(sw_id)
+
+    def handle_area_routes(self, update):
+        assert self.lock.locked()
+        routes    = {int(border_id): {dest: (via, dist) for dest, via, dist in rows}
+                     for border_id, rows in update['routes'].items()}
+        addresses = {int(sw_id): tuple(addr) for sw_id, addr in update['addresses'].items()}
+        if addresses != self.foreign_addresses:
+            # border switches learn the host/port of their foreign neighbors
+            self.foreign_addresses = addresses
+            for sw_id in self.bootstrapped_border_map:
+                if sw_id in self.registery:
+                    self.send_register_response(sw_id)
+        if routes != self.area_routes:
+            self.area_routes = routes
+            for rows in routes.values():
+                self.foreign_dests.update(rows.keys())
+            self.update_routing()
+
+    # what the root needs to stitch inter area routes: the address of each border
+    # switch, its configured and its live links out of the area, and its distance
+    # to every local switch
+    def build_summary(self):
+        assert self.lock.locked()
+        borders = [sw_id for sw_id in self.bootstrapped_border_map if sw_id in self.registery]
+        return {'area':    self.area_id,
+                'borders': {b: [self.registery[b].host, self.registery[b].port] for b in borders},
+                'peers':   [[b, nb_id] for b in borders for nb_id in self.bootstrapped_border_map[b]],
+                'links':   [[b, nb_id, dist] for b in borders for nb_id, dist in self.border_map.get(b, {}).items()],
+                'dist':    {b: {dest: dist for dest, _, dist in self.routing_table.get(b, [])
+                                if dest in self.members and dist < self._djk_max} for b in borders}}
+
+    # the summary doubles as the keep alive of the area, so it is resent every PING_TIME
+    def summary_is_due(self):
+        return self.summary_dirty or (datetime.now() - self.summary_age > self.summary_delta)
+
+    def send_summary(self):
+        assert self.lock.locked()
+        summary = self.build_summary()
+        if summary != self.summary or datetime.now() - self.summary_age > self.summary_delta:
+            msg = {'action':'area_summary', 'data':summary}
+            self._sender.send_queue_append((json.dumps(msg).encode(), self.root))
+            self.summary     = summary
+            self.summary_age = datetime.now()
+        self.summary_dirty = False
+
+"""
+The Area class tracks an area controller from the root controller, it is kept alive by the
+summaries that the area sends every PING_TIME.
+"""
+class Area(ctl.Switch):
+    def __init__(self, id, host, port, sender):
+        super().__init__(id, host, port, sender)
+        self.summary = None
+    def __repr__(self):
+        return f'<Area({self.id})>'
+
+"""
+The RootController class joins the summaries of all area controllers into a backbone graph of
+border switches. The backbone edges are the live links between areas and the intra area distances
+between borders of the same area. From it, the root computes for each border switch the distance to
+every foreign destination and the first backbone hop (<Via_ID>) on the way there. The <Via_ID> is
+either a foreign neighbor or another border switch of the same area.
+"""
+class RootController():
+    def __init__(self, sender):
+        self._djk_max = 9999
+        self._sender  = sender
+        self.lock     = threading.Lock()
+        self.areas    = {}
+        self.area_routes = {}
+        self.sent_routes = {}
+        self.defer_routing = False
+        self.routing_dirty = False
+        self.diag = None
+        self.log_file_name = ROOT_LOG_FILE
+        self.log = []
+    def __str__(self, blocking=True):
+        if blocking: self.lock.acquire()
+        msg = 'RootController:\n  '
+        msg += '\n  '.join([f'{k} == {v}' for (k,v) in self.__dict__.items()])
+        if blocking: self.lock.release()
+        return msg
+
+    def calc_area_routes(self):
+        assert self.lock.locked()
+        summaries = {a.id: a.summary for a in self.areas.values() if a.summary != None}
+        owner = {b: area_id for area_id, s in summaries.items() for b in s['borders']}
+        up    = {(b, nb_id) for s in summaries.values() for b, nb_id, _ in s['links']}
+        graph = {b: {} for b in owner}
+        for s in summaries.values():
+            for b in s['borders']:
+                for dest, dist in s['dist'][b].items():
+                    if dest != b and dest in s['borders']:
+                        graph[b][dest] = dist
+            # links only count once both ends report them alive
+            for b, nb_id, dist in s['links']:
+                if nb_id in graph and (nb_id, b) in up:
+                    graph[b][nb_id] = dist
+
+        self.area_routes = {area_id: {'routes':{}, 'addresses':{}} for area_id in summaries}
+        for start in graph:
+            # djkstras over the backbone, remembering the first hop of each path
+            distances = {start: 0}
+            first_hop = {}
+            visited   = set()
+            queue = [(0, start, None)]
+            while queue:
+                current_distance, current_node, hop = heapq.heappop(queue)
+                if current_node not in visited:
+                    visited.add(current_node)
+                    first_hop[current_node] = hop
+                    for adjacent, weight in graph[current_node].items():
+                        distance = current_distance + weight
+                        if distance < distances.get(adjacent, self._djk_max):
+                            distances[adjacent] = distance
+                            next_hop = adjacent if current_node == start else hop
+                            heapq.heappush(queue, (distance, adjacent, next_hop))
+
+            # cheapest way into every foreign area, then on to each of its switches
+            best = {}
+            for b in visited:
+                area_id = owner[b]
+                if area_id == owner[start]:
+                    continue
+                for dest, dist in summaries[area_id]['dist'][b].items():
+                    dist += distances[b]
+                    if dist < best.get(dest, (None, self._djk_max))[1]:
+                        best[dest] = (first_hop[b], dist)
+            self.area_routes[owner[start]]['routes'][start] = sorted(
+                [dest, via, dist] for dest, (via, dist) in best.items())
+
+        # border switches are told every configured foreign neighbor that is registered,
+        # live or not, so that a link comes back once both ends are up again
+        for area_id, s in summaries.items():
+            for b, nb_id in s['peers']:
+                if nb_id in owner:
+                    self.area_routes[area_id]['addresses'][nb_id] = summaries[owner[nb_id]]['borders'][nb_id]
+
+    # recomputes and ships the area routes, or only flags them while a batch of
+    # summaries is handled, same as Controller.update_routing()
+    def update_routing(self):
+        assert self.lock.locked()
+        if self.defer_routing:
+            self.routing_dirty = True
+            return
+        self.routing_dirty = False
+        self.calc_area_routes()
+        self.send_area_routes()
+
+    def send_area_routes(self):
+        assert self.lock.locked()
+        for area_id, update in self.area_routes.items():
+            if self.sent_routes.get(area_id) != update:
+                self.areas[area_id].send(json.dumps({'action':'area_routes', 'data':update}))
+                self.sent_routes[area_id] = update
+                self.log_area_routes_sent(area_id)
+
+    # answers the periodic summary of an area with its current routes, so a lost
+    # area_routes or a restarted area controller is repaired within PING_TIME
+    def resend_area_routes(self, area_id):
+        assert self.lock.locked()
+        if area_id in self.area_routes:
+            self.areas[area_id].send(json.dumps({'action':'area_routes', 'data':self.area_routes[area_id]}))
+
+    def handle_area_summary(self, host, port, summary):
+        assert self.lock.locked()
+        area_id = summary['area']
+        summary = {'borders': {int(b): tuple(addr) for b, addr in summary['borders'].items()},
+                   'peers':   [tuple(peer) for peer in summary['peers']],
+                   'links':   [tuple(link) for link in summary['links']],
+                   'dist':    {int(b): {int(dest): dist for dest, dist in dists.items()}
+                               for b, dists in summary['dist'].items()}}
+        if area_id not in self.areas:
+            self.areas[area_id] = Area(area_id, host, port, self._sender)
+            self.log_area_alive(area_id)
+            print(f'area alive {area_id}')
+        area = self.areas[area_id]
+        area.host, area.port = host, port
+        area.ping_age = datetime.now()
+        if summary != area.summary:
+            area.summary = summary
+            self.update_routing()
+        else:
+            self.resend_area_routes(area_id)
+
+    def handle_area_dead(self, area_id):
+        assert self.lock.locked()
+        self.areas.pop(area_id)
+        self.sent_routes.pop(area_id, None)
+        print(f'DEAD AREA: {area_id}')
+        self.log_area_dead(area_id)
+        self.update_routing()
+
+    def dump_log(self):
+        assert self.lock.locked()
+        with open(self.log_file_name, 'a+') as log_file:
+            log_file.write("\n\n")
+            log_file.writelines(self.log)
+            self.log = []
+    # Timestamp
+    # Area Alive <Area-ID>
+    def log_area_alive(self, area_id):
+        self.log.append(str(datetime.time(datetime.now())) + "\n")
+        self.log.append(f"Area Alive {area_id}\n")
+        self.dump_log()
+    # Timestamp
+    # Area Dead <Area-ID>
+    def log_area_dead(self, area_id):
+        self.log.append(str(datetime.time(datetime.now())) + "\n")
+        self.log.append(f"Area Dead {area_id}\n")
+        self.dump_log()
+    # Timestamp
+    # Area Routes <Area-ID>
+    def log_area_routes_sent(self, area_id):
+        self.log.append(str(datetime.time(datetime.now())) + "\n")
+        self.log.append(f"Area Routes {area_id}\n")
+        self.dump_log()
+
+def handle_area_action(host, port, data, controller:AreaController)->None:
+    assert controller.lock.locked()
+    if data['action'].lower() == 'area_routes':
+        if controller.is_booted:
+            controller.handle_area_routes(data['data'])
+    else:
+        ctl.handle_action(host, port, data, controller)
+
+def handle_root_action(host, port, data, root:RootController)->None:
+    assert root.lock.locked()
+    action = data['action'].lower()
+    if action == 'area_summary':
+        root.handle_area_summary(host, port, data['data'])
+    elif action == 'diag' and root.diag != None:
+        root.diag.request(data['data'])
+
+# dead switches, and keeping the root up to date
+def handle_area_timers(controller:AreaController)->None:
+    ctl.handle_dead_switches(controller)
+    with controller.lock:
+        if controller.is_booted and controller.summary_is_due():
+            controller.send_summary()
+
+def handle_dead_areas(root:RootController)->None:
+    with root.lock:
+        for area_id in list(root.areas.keys()):
+            if not root.areas[area_id].is_alive():
+                root.handle_area_dead(area_id)
+
+# the root and the areas answer from their well known port, so they send from the
+# socket they listen on (with workers, from the socket of the first worker)
+def bind_listener(port, workers):
+    if workers:
+        listener = BatchListener(port, workers)
+        return listener, listener.socket()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind(('0.0.0.0', port))
+    except OSError:
+        sock.close()
+        raise
+    return Listener(port, socket=sock, bufsize=DATAGRAM_SIZE), sock
+
+def run_root(args, listener, sock):
+    sender = Sender(sock)
+    root   = RootController(sender)
+    if args.diag:
+        diag = Diagnostics('Root')
+        ctl.install_diagnostics(diag, listener, sender, root)
+        diag.add_gauge('areas', lambda: len(root.areas))
+
+    print('\n\nStarting listener'.upper())
+    listener.start()
+
+    print('\n\nStarting sender'.upper())
+    sender.start()
+
+    print('\n\nStarting root controller process'.upper())
+    success = ctl.loop_handle_events(root, listener,
+                                     handle_action=handle_root_action,
+                                     handle_timers=handle_dead_areas)
+    print(f'\n\nRoot controller process completed: success = {success}'.upper())
+
+    sender.kill()
+    listener.kill()
+
+def run_area(args, listener, sock):
+    sender = Sender(sock)
+    cfg    = ctl.read_config(args.config_path)
+    areas  = read_areas(args.areas_path)
+    controller = AreaController(args.area_id, cfg, areas,
+                                (args.root_hostname, args.root_port),
+                                sender, args.latency_weight)
+    if args.diag:
+        diag = Diagnostics('area' + str(args.area_id))
+        ctl.install_diagnostics(diag, listener, sender, controller)
+        diag.add_gauge('registered_switches', lambda: len(controller.registery))
+
+    print('\n\nStarting listener'.upper())
+    listener.start()
+
+    print('\n\nStarting sender'.upper())
+    sender.start()
+
+    # same as the single controller but only for the area, the summary
+    # is sent to the root by handle_area_timers() once booted
+    ctl.run_controller(controller, listener,
+                       handle_action=handle_area_action,
+                       handle_timers=handle_area_timers)
+
+    sender.kill()
+    listener.kill()
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='area.py',
+                        description='Hierarchical Simple Software Defnined Netowrk (SDN) Controllers')
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    root_parser = subparsers.add_parser('root', help='top level controller stitching routes between areas')
+    root_parser.add_argument('port', type=int, help='port for the root controller to listen on (must be integer)')
+    root_parser.set_defaults(run=run_root)
+
+    area_parser = subparsers.add_parser('area', help='controller of the switches in one area')
+    area_parser.add_argument('port', type=int, help='port for the area controller to listen on (must be integer)')
+    area_parser.add_argument('config_path', type=str, help='path of the config file')
+    area_parser.add_argument('areas_path', type=str, help='path of the areas file')
+    area_parser.add_argument('area_id', type=int, help='id of the area this controller owns (must be integer)')
+    area_parser.add_argument('root_hostname', type=str, help='host of the root controller')
+    area_parser.add_argument('root_port', type=int, help='port of the root controller (must be integer)')
+    area_parser.add_argument('-l', '--latency-weight',
+                             type=float,
+                             default=0.0,
+                             help='share (0 to 1) of each intra area link weight taken from the measured link latency in ms')
+    area_parser.set_defaults(run=run_area)
+
+    for role_parser in (root_parser, area_parser):
+        role_parser.add_argument('-w', '--workers',
+                                 type=int,
+                                 default=0,
+                                 help='number of SO_REUSEPORT receive workers with batched event handling, 0 uses a single listener')
+        role_parser.add_argument('-d', '--diag',
+                                 action='store_true',
+                                 help='enable profiling and diagnostics on SIGUSR1/SIGUSR2 and "diag" messages')
+
+    args = parser.parse_args()
+    role_parser = root_parser if args.role == 'root' else area_parser
+    if args.role == 'area' and not 0 <= args.latency_weight <= 1:
+        role_parser.error('--latency-weight must be between 0 and 1')
+    if args.workers < 0:
+        role_parser.error('--workers must not be negative')
+    try:
+        listener, sock = bind_listener(args.port, args.workers)
+    except OSError as e:
+        role_parser.error(f'cannot listen on port {args.port}: {e}')
+    args.run(args, listener, sock)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 import threading
 import socket
+import select
+import json
 
 PING_TIME = 2               # every PING_TIME seconds, a broadcast alive ping to all neighbors
 TIMEOUT = 3 * PING_TIME     # neighbors flagged as DEAD if have not recieved an alive ping by timeout
+RTT_ALPHA = 0.125           # gain of the smoothed per-neighbor round trip time (same as TCP SRTT)
+DATAGRAM_SIZE = 8192        # largest datagram a BatchListener worker accepts
+BATCH_SIZE = 64             # most datagrams a BatchListener worker drains per wake up
+EVENT_WAIT = 0.05           # longest an event loop sleeps waiting for events before checking its timers
 
 """
 The Listener class provides functionality for setting up a UDP listener on a specified port. 
@@ -10,18 +16,21 @@ It inherits from threading.Thread to allow concurrent execution. It listens for
 packets and adds them to an event queue for processing. The class includes methods to control 
 its execution and manage the event queue.
 Usage:
-- Initialize with a port number or socket object.
+- Initialize with a port number or socket object, and optionally the largest datagram to accept.
 - Call the run() method to start listening for incoming packets.
+- Use the event_queue_wait() method to sleep until events are queued.
 - Use the event_queue_pop() method to retrieve events from the event queue.
 - Use the kill() method to stop the listener thread.
 """
 class Listener(threading.Thread):
-    def __init__(self, port=None, socket=None):
+    def __init__(self, port=None, socket=None, bufsize=1024):
         super().__init__()
         self._port = port
         self._sock = socket
+        self._bufsize = bufsize
         self._event_queue = []
         self._event_queue_lock = threading.Lock()
+        self._event_queue_ready = threading.Event()
         self._stay_alive = threading.Event()
     def run(self):
         self._stay_alive.set()
@@ -36,7 +45,7 @@ class Listener(threading.Thread):
                         self._sock.bind(('0.0.0.0', self._port))
                 while True:
                     try: 
-                        data, addr = self._sock.recvfrom(1024)
+                        data, addr = self._sock.recvfrom(self._bufsize)
                         self._event_queue_append((addr, data))
                     except socket.timeout:
                         break
@@ -46,13 +55,114 @@ class Listener(threading.Thread):
             self.kill()
     def kill(self):
         self._stay_alive.clear()   
+    def event_queue_wait(self, timeout=None):
+        return self._event_queue_ready.wait(timeout)
     def event_queue_pop(self, n=0):
         with self._event_queue_lock:
             val = self._event_queue.pop(n)
+            if not self._event_queue:
+                self._event_queue_ready.clear()
         return val
     def _event_queue_append(self, event):
         with self._event_queue_lock:
             self._event_queue.append(event)
+            self._event_queue_ready.set()
+    def event_queue_size(self):
+        with self._event_queue_lock:
+            sz = len(self._event_queue)
+        return sz
+
+"""
+The ReceiveWorker class provides one receiver of a BatchListener. It binds its own UDP socket to
+the shared port with SO_REUSEPORT, so the kernel spreads incoming datagrams over the workers. The
+socket is bound when the worker is created, so a bind failure is raised to its creator. The socket
+stays blocking (it is drained with MSG_DONTWAIT), so a Sender may share it. On every wake up it drains up to batch_size datagrams with recvfrom_into() into a preallocated buffer,
+parses them and hands the whole batch over with a single call to deliver().
+"""
+class ReceiveWorker(threading.Thread):
+    def __init__(self, port, deliver, batch_size=BATCH_SIZE):
+        super().__init__(daemon=True)
+        self._port = port
+        self._deliver = deliver
+        self._batch_size = batch_size
+        self._buf = bytearray(batch_size * DATAGRAM_SIZE)
+        self._view = memoryview(self._buf)
+        self._stay_alive = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.sock.bind(('0.0.0.0', self._port))
+        except OSError:
+            self.sock.close()
+            raise
+    def run(self):
+        self._stay_alive.set()
+        sock = self.sock
+        try:
+            while self._stay_alive.is_set():
+                readable, _, _ = select.select([sock], [], [], 1)
+                if not readable:
+                    continue
+                received = []
+                for offset in range(0, len(self._buf), DATAGRAM_SIZE):
+                    try:
+                        n, addr = sock.recvfrom_into(self._view[offset:offset + DATAGRAM_SIZE], 0, socket.MSG_DONTWAIT)
+                    except BlockingIOError:
+                        break
+                    received.append((offset, n, addr))
+                events = []
+                for offset, n, addr in received:
+                    try:
+                        events.append((addr, json.loads(str(self._view[offset:offset + n], 'utf-8'))))
+                    except ValueError as e:
+                        print(f'{e}\nERROR READING EVENT: {addr[0]}:{addr[1]}\n')
+                if events:
+                    self._deliver(events)
+        finally:
+            sock.close()
+    def kill(self):
+        self._stay_alive.clear()
+
+"""
+The BatchListener class is a high throughput alternative to the Listener class. It runs several
+ReceiveWorker threads on the same port and collects their parsed events into one event queue, which
+is drained in batches instead of one event at a time.
+Usage:
+- Initialize with a port number and the number of workers.
+- Call the start() method to start the workers.
+- Use the event_queue_wait() method to sleep until events are queued.
+- Use the event_queue_pop_batch() method to retrieve every queued (addr, message) event at once.
+- Use the socket() method to send from the shared port.
+- Use the kill() method to stop the workers.
+"""
+class BatchListener():
+    def __init__(self, port, workers=4, batch_size=BATCH_SIZE):
+        self._port = port
+        self._event_queue = []
+        self._event_queue_lock = threading.Lock()
+        self._event_queue_ready = threading.Event()
+        self._workers = [ReceiveWorker(port, self._event_queue_extend, batch_size) for _ in range(workers)]
+    def start(self):
+        print(f'batch listener (UDP) spinning up {len(self._workers)} workers on: {socket.gethostname()}:{self._port}')
+        for worker in self._workers:
+            worker.start()
+    def kill(self):
+        for worker in self._workers:
+            worker.kill()
+    def socket(self):
+        return self._workers[0].sock
+    def event_queue_wait(self, timeout=None):
+        return self._event_queue_ready.wait(timeout)
+    def event_queue_pop_batch(self):
+        with self._event_queue_lock:
+            batch, self._event_queue = self._event_queue, []
+            self._event_queue_ready.clear()
+        return batch
+    def _event_queue_extend(self, events):
+        with self._event_queue_lock:
+            self._event_queue.extend(events)
+            self._event_queue_ready.set()
     def event_queue_size(self):
         with self._event_queue_lock:
             sz = len(self._event_queue)
@@ -61,7 +171,8 @@ class Listener(threading.Thread):
 """
 The Sender class provides functionality for sending UDP packets. It inherits from threading.Thread 
 to allow concurrent execution. It sends packets from a send queue and includes methods to manage 
-the send queue and control its execution.
+the send queue and control its execution. The send queue is drained in batches, the sender sleeps 
+while the queue is empty.
 Usage:
 - Initialize with a socket object.
 - Call the run() method to start sending packets.
@@ -74,28 +185,32 @@ class Sender(threading.Thread):
         self._sock = socket
         self._send_queue = []
         self._send_queue_lock = threading.Lock()
+        self._send_queue_ready = threading.Event()
         self._stay_alive = threading.Event()
     def run(self):
         self._stay_alive.set()
         while self._stay_alive.is_set():
             try:
-                if self.send_queue_size() > 0:
-                    self._sock.sendto( *self._send_queue_pop() )
+                if self._send_queue_ready.wait(timeout=1):
+                    for msg, addr in self._send_queue_pop_batch():
+                        self._sock.sendto(msg, addr)
             except KeyboardInterrupt:
                 print('keyboard interrupt in sender loop'.upper())
                 self.kill()
     def kill(self):
         self._stay_alive.clear()   
-    def _send_queue_pop(self, n=0):
+    def _send_queue_pop_batch(self):
         with self._send_queue_lock:
-            val = self._send_queue.pop(n)
-        return val
+            batch, self._send_queue = self._send_queue, []
+            self._send_queue_ready.clear()
+        return batch
     def send_queue_append(self, event, front=False):
         with self._send_queue_lock:
             if front:
                 self._send_queue.insert(0, event)
             else:
                 self._send_queue.append(event)
+            self._send_queue_ready.set()
     def send_queue_size(self):
         with self._send_queue_lock:
             sz = len(self._send_queue)
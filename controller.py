@@ -10,10 +10,18 @@ import heapq
 from copy import deepcopy
 from itertools import permutations
 
-from com import Listener, Sender, PING_TIME, TIMEOUT
+from com import Listener, BatchListener, Sender, PING_TIME, TIMEOUT, EVENT_WAIT
+from diag import Diagnostics
 
 LOG_FILE = "Controller.log"
 
+# measured latency only moves a link weight when the blended weight leaves a band of
+# max(LATENCY_MIN_DELTA, LATENCY_HYSTERESIS * current weight) around the applied one,
+# and latency driven recomputes are spaced at least LATENCY_HOLD_DOWN apart
+LATENCY_MIN_DELTA  = 5
+LATENCY_HYSTERESIS = 0.2
+LATENCY_HOLD_DOWN  = timedelta(seconds=2 * PING_TIME)
+
 class Switch():
     def __init__(self, id, host, port, sender):
         self.id   = id
@@ -38,14 +46,20 @@ class Switch():
         return is_alv
 
 class Controller():
-    def __init__(self, cfg, sender):
+    def __init__(self, cfg, sender, latency_weight=0.0):
         self._djk_max   = 9999
         self.topology = cfg.get('num_switches')
         self.map           = {}
         self.bootstrapped_map = {}
         self.routing_table = {}
+        self.link_cost     = {}
         for edge in cfg.get('edges'): 
             self.update_map(edge)
+            self.link_cost[self._link_key(edge[0], edge[1])] = edge[2]
+        self.latency_weight = latency_weight
+        self.link_latency   = {}
+        self.latency_stale  = set()     # links whose latency changed since the last check
+        self.latency_age    = datetime.min
         self._sender    = sender
         self.paths     = {}
         self.lock      = threading.Lock()
@@ -53,6 +67,9 @@ class Controller():
         self.log_file_name = LOG_FILE
         self.log       = []
         self.is_booted = False
+        self.defer_routing = False
+        self.routing_dirty = False
+        self.diag = None
     def __str__(self, blocking=True):
         if blocking: self.lock.acquire()
         msg = 'Controller:\n  '
@@ -66,6 +83,48 @@ class Controller():
         if self.map.get(edge[1]) == None: self.map[edge[1]]          = {edge[0]: edge[2]}
         else:                             self.map[edge[1]][edge[0]] = edge[2]
 
+    @staticmethod
+    def _link_key(sw_id_1, sw_id_2):
+        return (min(sw_id_1, sw_id_2), max(sw_id_1, sw_id_2))
+
+    # blends the measured latency (ms) of the links of sw_id into the map weights
+    # links reported during the hold down are all checked once it is over
+    # returns True if any weight moved far enough to be worth a recompute
+    def update_link_latency(self, sw_id, rtts):
+        assert self.lock.locked()
+        if not self.latency_weight:
+            return False
+        for nb_id, rtt in rtts.items():
+            key = self._link_key(sw_id, int(nb_id))
+            if self.link_latency.get(key) != float(rtt):
+                self.link_latency[key] = float(rtt)
+                self.latency_stale.add(key)
+        if datetime.now() - self.latency_age < LATENCY_HOLD_DOWN:
+            return False
+
+        changed = False
+        for key in self.latency_stale:
+            sw_1, sw_2 = key
+            if sw_2 in self.map.get(sw_1, {}):
+                current = self.map[sw_1][sw_2]
+            elif sw_1 in self.map.get(sw_2, {}):
+                current = self.map[sw_2][sw_1]
+            else:
+                continue
+            weight  = (1 - self.latency_weight) * self.link_cost[key] + self.latency_weight * self.link_latency[key]
+            weight  = max(1, round(weight))
+            if abs(weight - current) >= max(LATENCY_MIN_DELTA, LATENCY_HYSTERESIS * current):
+                if sw_2 in self.map.get(sw_1, {}):
+                    self.map[sw_1][sw_2] = weight
+                if sw_1 in self.map.get(sw_2, {}):
+                    self.map[sw_2][sw_1] = weight
+                changed = True
+                print(f'link weight {sw_1}<->{sw_2}: {current} -> {weight}')
+        self.latency_stale.clear()
+        if changed:
+            self.latency_age = datetime.now()
+        return changed
+
     def calc_routing_table_djk(self):
         unseen_combos = set(permutations(self.bootstrapped_map.keys(), 2))
         self.routing_table = {}
@@ -105,6 +164,23 @@ class Controller():
                 continue
             self.routing_table[start].append((dest, -1, self._djk_max))
 
+    # neighbors of a switch as (<Neighbor_ID>, <Neighbor_Host>, <Neighbor_Port>)
+    def register_table(self, switch_id):
+        return [(self.registery[neighbor_id].id, 
+                 self.registery[neighbor_id].host, 
+                 self.registery[neighbor_id].port) for neighbor_id in self.map[switch_id].keys()]
+
+    # recomputes and ships the routing table, or only flags it while a batch of
+    # events is handled so that the whole batch costs a single recompute
+    def update_routing(self):
+        assert self.lock.locked()
+        if self.defer_routing:
+            self.routing_dirty = True
+            return
+        self.routing_dirty = False
+        self.calc_routing_table_djk()
+        self.send_routing_table_update()
+
     def send_register_response(self, switch_id=None):
         if switch_id == None:
             switches = self.registery.values()
@@ -113,9 +189,7 @@ class Controller():
         for s in switches:
             msg = {'action':'register_response',
                     'data': {'id':s.id, 
-                             'table':[(self.registery[neighbor_id].id, 
-                                       self.registery[neighbor_id].host, 
-                                       self.registery[neighbor_id].port) for neighbor_id in self.map[s.id].keys()]}}
+                             'table':self.register_table(s.id)}}
 
             s.send(json.dumps(msg))
             self.log_register_response_sent(s.id)
@@ -143,13 +217,12 @@ class Controller():
                 if switch_id in self.bootstrapped_map[bsm_id]:
                     self.map[bsm_id][switch_id] = self.bootstrapped_map[bsm_id][switch_id]
 
-            self.calc_routing_table_djk()
             self.log_topology_update_switch_alive(switch_id)
             self.send_register_response()
-            self.send_routing_table_update()
+            self.update_routing()
         print(f'registered {switch_id}')
     
-    def handle_topology_update(self, top_update):
+    def handle_topology_update(self, top_update, rtts=None):
         assert self.lock.locked()
         do_calc = False
         sw_id = list(top_update.keys())[0]
@@ -163,9 +236,11 @@ class Controller():
                     self.log_topology_update_link_dead(sw_id, link_id)
                     self.map[int(sw_id)].pop(link_id)
                     print(f'link dead {sw_id}->{link_id}')
+            # fold in measured link latency when enabled
+            if rtts and self.update_link_latency(int(sw_id), rtts):
+                do_calc = True
             if do_calc:
-                self.calc_routing_table_djk()
-                self.send_routing_table_update()
+                self.update_routing()
 
     def handle_switch_dead(self, sw_id):
         assert self.lock.locked()
@@ -176,8 +251,7 @@ class Controller():
         self.map.pop(sw_id)
         print(f'DEAD SWITCH: {sw_id}')
         self.log_topology_update_switch_dead(sw_id)
-        self.calc_routing_table_djk()
-        self.send_routing_table_update()
+        self.update_routing()
                 
     def dump_log(self):
         assert self.lock.locked()
@@ -240,81 +314,81 @@ def read_config(f_name):
     }
     return cfg
 
-def handle_event(event, controller:Controller)->None:
+def handle_action(host, port, data, controller:Controller)->None:
+    assert controller.lock.locked()
+    action = data['action'].lower()
+    if action == 'register_request':
+        controller.handle_register_request(host, port, data['data'])
+    elif action == 'topology_update' and controller.is_booted:
+        controller.handle_topology_update(data['data'], data.get('rtt'))
+    elif action == 'diag' and controller.diag != None:
+        controller.diag.request(data['data'])
+
+def handle_event(event, controller:Controller, handle_action=handle_action)->None:
     (host, port), data = event
     data = json.loads(data.decode())
     try:
-        action = data['action'].lower()
-        if action == 'register_request':
-            with controller.lock:
-                controller.handle_register_request(host, port, data['data'])
-
-        # not locked becasue is_booted is only modified one time within
-        # a lock after the bootstrap process is completed
-        if controller.is_booted:
-            if action == 'topology_update':
-                with controller.lock:
-                    controller.handle_topology_update(data['data'])
-
+        with controller.lock:
+            handle_action(host, port, data, controller)
     except Exception as e:
-        if controller.lock.locked():
-            controller.lock.release()
         print(f'{e}\nERROR READING EVENT: {host}:{port}\n{data}\n')
 
-def loop_handle_events(controller, listener, do_break=lambda: False):
+# handles a batch of parsed events from a BatchListener under one lock
+# with at most one routing recompute for the whole batch
+def handle_event_batch(events, controller:Controller, handle_action=handle_action)->None:
+    with controller.lock:
+        controller.defer_routing = True
+        for (host, port), data in events:
+            try:
+                handle_action(host, port, data, controller)
+            except Exception as e:
+                print(f'{e}\nERROR READING EVENT: {host}:{port}\n{data}\n')
+        controller.defer_routing = False
+        if controller.routing_dirty:
+            controller.update_routing()
+
+def handle_dead_switches(controller:Controller)->None:
+    with controller.lock:
+        if controller.is_booted:
+            for sw_id in deepcopy(list(controller.registery.keys())):
+                if not controller.registery[sw_id].is_alive():
+                    controller.handle_switch_dead(sw_id)
+
+# sleeps until the listener queues events, waking up at least every EVENT_WAIT
+# to run handle_timers() (i.e. to find dead switches)
+def loop_handle_events(controller, listener, do_break=lambda: False,
+                       handle_action=handle_action, handle_timers=handle_dead_switches):
     success = True
     try:
         while not do_break():
             # handle incoming events
-            if listener.event_queue_size() > 0:
-                event  = listener.event_queue_pop()
-                thread = threading.Thread(target=handle_event, args=(event, controller))
-                thread.start()
-
-            with controller.lock:
-                if controller.is_booted:
-                    # handle dead switches
-                    for sw_id in deepcopy(list(controller.registery.keys())):
-                        if not controller.registery[sw_id].is_alive():
-                            controller.handle_switch_dead(sw_id)
+            if listener.event_queue_wait(EVENT_WAIT):
+                if isinstance(listener, BatchListener):
+                    events = listener.event_queue_pop_batch()
+                    if events:
+                        handle_event_batch(events, controller, handle_action)
+                elif listener.event_queue_size() > 0:
+                    event  = listener.event_queue_pop()
+                    thread = threading.Thread(target=handle_event, args=(event, controller, handle_action))
+                    thread.start()
+
+            handle_timers(controller)
     except KeyboardInterrupt:
         print('keyboard interrupt in loop_handle_events()')
         success = False
-        if controller.lock.locked():
-            controller.lock.release()
     return success
 
-def main():
-    parser = argparse.ArgumentParser(
-                        prog='Controller.py',
-                        description='Simple Software Defnined Netowrk (SDN) Controller')
-    parser.add_argument('port', type=int, help='port for the controller to listen on (must be integer)')
-    parser.add_argument('config_path', type=str, help='path of the config file')
-    args = parser.parse_args()
-    
-    print('\n\nStarting listener'.upper())
-    listener = Listener(args.port)
-    listener.start()
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    print('\n\nStarting sender'.upper())
-    sender = Sender(sock)
-    sender.start()
-
-    cfg = read_config(args.config_path)
-    controller = Controller(cfg, sender)
-
-    # bootstraping process
-    # waiting for all switches to register
-    # all events that are not register requests durring this time are ignored
+# bootstraping process, waiting for all switches to register, all events that are not
+# register requests durring this time are ignored. Then the register responses and
+# routing tables are broadcast and the controller runs until interrupted
+def run_controller(controller, listener, **handlers):
     def is_booted():
         ret = False
         with controller.lock:
             if controller.topology == len(controller.registery.keys()):
                 ret = True
         return ret
-    success = loop_handle_events(controller, listener, is_booted)
+    success = loop_handle_events(controller, listener, is_booted, **handlers)
     controller.bootstrapped_map = deepcopy(controller.map)
     for sw_id in deepcopy(list(controller.registery.keys())):
         controller.registery[sw_id].ping_age = datetime.now()
@@ -334,8 +408,68 @@ def main():
 
         # start the main controller process 
         print('\n\nStarting main controller process'.upper())
-        success = loop_handle_events(controller, listener)
+        success = loop_handle_events(controller, listener, **handlers)
         print(f'\n\nMain controller process completed: success = {success}'.upper())
+    return success
+
+# swaps the locks of the listener, sender and controller for timed ones,
+# must be called before any of their threads is started
+def install_diagnostics(diag, listener, sender, controller):
+    diag.instrument_lock(listener, '_event_queue_lock', 'listener')
+    diag.add_gauge('listener_queue', listener.event_queue_size)
+    diag.instrument_lock(sender, '_send_queue_lock', 'sender')
+    diag.add_gauge('sender_queue', sender.send_queue_size)
+    diag.instrument_lock(controller, 'lock', 'controller')
+    diag.install_signal_handlers()
+    controller.diag = diag
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='Controller.py',
+                        description='Simple Software Defnined Netowrk (SDN) Controller')
+    parser.add_argument('port', type=int, help='port for the controller to listen on (must be integer)')
+    parser.add_argument('config_path', type=str, help='path of the config file')
+    parser.add_argument('-l', '--latency-weight',
+                        type=float,
+                        default=0.0,
+                        help='share (0 to 1) of each link weight taken from the measured link latency in ms, 0 keeps the static config weights')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=0,
+                        help='number of SO_REUSEPORT receive workers with batched event handling, 0 uses a single listener')
+    parser.add_argument('-d', '--diag',
+                        action='store_true',
+                        help='enable profiling and diagnostics on SIGUSR1/SIGUSR2 and "diag" messages')
+    args = parser.parse_args()
+    if not 0 <= args.latency_weight <= 1:
+        parser.error('--latency-weight must be between 0 and 1')
+    if args.workers < 0:
+        parser.error('--workers must not be negative')
+
+    if args.workers:
+        try:
+            listener = BatchListener(args.port, args.workers)
+        except OSError as e:
+            parser.error(f'cannot listen on port {args.port}: {e}')
+    else:
+        listener = Listener(args.port)
+    sock   = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = Sender(sock)
+
+    cfg = read_config(args.config_path)
+    controller = Controller(cfg, sender, args.latency_weight)
+    if args.diag:
+        diag = Diagnostics('Controller')
+        install_diagnostics(diag, listener, sender, controller)
+        diag.add_gauge('registered_switches', lambda: len(controller.registery))
+
+    print('\n\nStarting listener'.upper())
+    listener.start()
+
+    print('\n\nStarting sender'.upper())
+    sender.start()
+
+    run_controller(controller, listener)
 
     listener.kill()
     print('program complete ')
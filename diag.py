@@ -0,0 +1,280 @@
+import cProfile
+import pstats
+import signal
+import sys
+import os
+import re
+import queue
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+SAMPLE_INTERVAL = 0.01      # seconds between two stack samples of all threads
+TRACEMALLOC_TOP = 20        # allocation sites listed in a diagnostics dump
+
+COMMANDS = ('profile_start', 'profile_stop', 'sample_start', 'sample_stop',
+            'tracemalloc_start', 'tracemalloc_stop', 'dump')
+
+"""
+The TimedLock class wraps a lock and records how often it is taken, how long threads wait for it
+and how long it is held. The statistics are only written while the lock is held, so they need no
+lock of their own. It is a drop in replacement for the threading.Lock objects used in this project.
+"""
+class TimedLock():
+    def __init__(self, lock, name):
+        self.name = name
+        self._lock = lock
+        self._acquired_at = 0.0
+        self.acquires  = 0
+        self.wait_time = 0.0
+        self.hold_time = 0.0
+        self.hold_max  = 0.0
+    def __repr__(self):
+        return f'<TimedLock({self.name})>'
+    def __enter__(self):
+        self.acquire()
+        return self
+    def __exit__(self, *exc):
+        self.release()
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        is_acquired = self._lock.acquire(blocking, timeout)
+        if is_acquired:
+            self._acquired_at = time.perf_counter()
+            self.acquires  += 1
+            self.wait_time += self._acquired_at - start
+        return is_acquired
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self.hold_time += held
+        self.hold_max   = max(self.hold_max, held)
+        self._lock.release()
+    def locked(self):
+        return self._lock.locked()
+
+"""
+The Diagnostics class provides on demand profiling of a running controller or switch. Nothing is
+installed until the process is started with diagnostics enabled, so it costs nothing otherwise.
+Commands run one at a time on a diagnostics thread started up front. Signal handlers only queue the
+command, so they never wait on a lock held by the thread they interrupted.
+All output files are named after the process (i.e. Controller.prof, switch0.stacks).
+Usage:
+- Initialize with the name of the process.
+- Use add_gauge() to register sizes (i.e. queue lengths) and instrument_lock() to time locks.
+- Call install_signal_handlers() from the main thread:
+    SIGUSR1 toggles cProfile (<name>.prof) and the stack sampler (<name>.stacks, collapsed stacks),
+            before 3.12 only SIGUSR1 profiles the main thread, the 'profile_start' command
+            covers the threads started while profiling
+    SIGUSR2 appends a dump to <name>.diag, the first one also starts tracemalloc
+- Use request() to run one of the COMMANDS, i.e. from a 'diag' control message.
+"""
+class Diagnostics():
+    def __init__(self, name):
+        self.name = name
+        self._gauges = {}
+        self._locks  = []
+        self._commands = queue.SimpleQueue()
+        self._worker   = threading.Thread(target=self._run, name='diagnostics', daemon=True)
+        self._profiling = False
+        self._profilers = []
+        self._profilers_lock = threading.Lock()
+        self._main_profiler  = None
+        self._main_profiles  = queue.SimpleQueue()   # main thread profilers handed to profile_stop()
+        self._sampling = threading.Event()
+        self._sampler  = None
+        self._stacks   = Counter()
+        self._snapshot = None
+        self._worker.start()
+
+    def add_gauge(self, name, fn):
+        self._gauges[name] = fn
+
+    # swaps obj.attr for a TimedLock, must be done before other threads use the lock
+    def instrument_lock(self, obj, attr, name=None):
+        lock = TimedLock(getattr(obj, attr), name or attr)
+        setattr(obj, attr, lock)
+        self._locks.append(lock)
+        return lock
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGUSR1, self._on_profile_signal)
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.request('dump_tracemalloc'))
+
+    # runs on the main thread, which before 3.12 can only be profiled by a profiler it
+    # enables itself (i.e. loop_handle_events), Profile.enable() and disable() take no locks
+    def _on_profile_signal(self, signum, frame):
+        if sys.version_info >= (3, 12):
+            self.request('profile_toggle')
+        elif self._main_profiler == None:
+            self._main_profiler = cProfile.Profile()
+            self._main_profiler.enable()
+            self.request('profile_on')
+        else:
+            profiler, self._main_profiler = self._main_profiler, None
+            profiler.disable()
+            self._main_profiles.put(profiler)
+            self.request('profile_off')
+
+    # SimpleQueue.put() is safe to call from a signal handler
+    def request(self, cmd):
+        self._commands.put(cmd)
+
+    def _run(self):
+        while True:
+            self.command(self._commands.get())
+
+    def command(self, cmd):
+        if cmd == 'profile_toggle':
+            cmd = 'profile_off' if self._profiling else 'profile_on'
+        if cmd == 'profile_on':
+            self.sample_start()
+            self.profile_start()
+        elif cmd == 'profile_off':
+            self.profile_stop()
+            self.sample_stop()
+        elif cmd == 'dump_tracemalloc':
+            if not tracemalloc.is_tracing():
+                self.tracemalloc_start()
+            self.dump()
+        elif cmd in COMMANDS:
+            getattr(self, cmd)()
+        else:
+            print(f'unknown diagnostics command: {cmd}')
+
+    def profile_start(self):
+        if self._profiling:
+            return
+        self._profiling = True
+        if sys.version_info >= (3, 12):
+            # cProfile observes every thread from 3.12 on
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self._profilers.append([profiler, threading.current_thread()])
+        else:
+            # before 3.12 a profiler only observes the thread that enabled it, so every
+            # thread started from now on (i.e. handle_event) gets one, that profiler
+            # stays on until its thread ends
+            threading.setprofile(self._profile_thread)
+        print(f'profiling started: {self.name}')
+
+    # a profiler is handed on once the thread it was enabled in has ended, so there
+    # are never more profilers than threads running at once
+    def _profile_thread(self, frame, event, arg):
+        thread = threading.current_thread()
+        with self._profilers_lock:
+            for entry in self._profilers:
+                if not entry[1].is_alive():
+                    profiler, entry[1] = entry[0], thread
+                    break
+            else:
+                profiler = cProfile.Profile()
+                self._profilers.append([profiler, thread])
+        profiler.enable()
+
+    def profile_stop(self):
+        self._profiling = False
+        threading.setprofile(None)
+        with self._profilers_lock:
+            profilers, self._profilers = self._profilers, []
+        for profiler, _ in profilers:
+            profiler.disable()
+        profilers = [profiler for profiler, _ in profilers]
+        while not self._main_profiles.empty():
+            profilers.append(self._main_profiles.get())
+        stats = None
+        for profiler in profilers:
+            try:
+                if stats == None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                # the profiler did not record any call
+                continue
+        if stats == None:
+            print(f'profiling stopped, nothing was captured: {self.name}')
+            return
+        stats.dump_stats(f'{self.name}.prof')
+        print(f'profiling stopped: {self.name}.prof')
+
+    def sample_start(self):
+        if self._sampling.is_set():
+            return
+        self._stacks = Counter()
+        self._sampling.set()
+        self._sampler = threading.Thread(target=self._sample, name='diagnostics sampler', daemon=True)
+        self._sampler.start()
+        print(f'stack sampling started: {self.name}')
+
+    def _sample(self):
+        own_ids = (threading.get_ident(), self._worker.ident)
+        while self._sampling.is_set():
+            # numbered thread names (i.e. "Thread-12 (handle_event)") are folded together
+            names = {t.ident: re.sub(r'-\d+', '', t.name) for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in own_ids:
+                    continue
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            time.sleep(SAMPLE_INTERVAL)
+
+    def sample_stop(self):
+        if not self._sampling.is_set():
+            return
+        self._sampling.clear()
+        self._sampler.join()
+        with open(f'{self.name}.stacks', 'w') as stacks_file:
+            stacks_file.writelines(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+        print(f'stack sampling stopped: {self.name}.stacks')
+
+    def tracemalloc_start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._snapshot = None
+            print(f'tracemalloc started: {self.name}')
+
+    def tracemalloc_stop(self):
+        tracemalloc.stop()
+        self._snapshot = None
+        print(f'tracemalloc stopped: {self.name}')
+
+    # Timestamp
+    # Threads <Count>
+    # Thread <Name> <Count>
+    # Gauge <Name> <Value>
+    # Lock <Name> acquires=<Count> wait=<Seconds> hold=<Seconds> hold_max=<Seconds>
+    # Memory <Allocation site and size>
+    # Memory Growth <Allocation site and growth since the last dump>
+    def dump(self):
+        log = [str(datetime.time(datetime.now())) + "\n"]
+        log.append(f"Threads {threading.active_count()}\n")
+        names = Counter(re.sub(r'-\d+', '', t.name) for t in threading.enumerate())
+        for name, count in names.most_common():
+            log.append(f"Thread {name} {count}\n")
+        for name, fn in self._gauges.items():
+            log.append(f"Gauge {name} {fn()}\n")
+        for lock in self._locks:
+            log.append(f"Lock {lock.name} acquires={lock.acquires} wait={lock.wait_time:.6f} "
+                       f"hold={lock.hold_time:.6f} hold_max={lock.hold_max:.6f}\n")
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                log.append(f"Memory {stat}\n")
+            if self._snapshot != None:
+                for stat in snapshot.compare_to(self._snapshot, 'lineno')[:TRACEMALLOC_TOP]:
+                    log.append(f"Memory Growth {stat}\n")
+            self._snapshot = snapshot
+        with open(f'{self.name}.diag', 'a+') as diag_file:
+            diag_file.write("\n\n")
+            diag_file.writelines(log)
+        print(f'diagnostics dumped: {self.name}.diag')
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import json
+import mmap
+from collections import deque, Counter
+from operator import itemgetter
+
+DETECTION_WINDOW = 60           # seconds a switch detection is matched against a controller event
+DAY = 24 * 60 * 60
+
+# yields the entries of a log, the text between two blank lines, from a memory map
+# so that the file is never loaded whole
+def iter_entries(f_name):
+    with open(f_name, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+            log_map.madvise(mmap.MADV_SEQUENTIAL)
+            pos, end = 0, len(log_map)
+            while pos < end:
+                nxt = log_map.find(b'\n\n', pos)
+                if nxt == -1:
+                    nxt = end
+                if nxt > pos:
+                    yield log_map[pos:nxt]
+                pos = nxt + 2
+
+# yields (<Time>, <Event>, <Value>) for every entry of a Controller.log or switch#.log
+# <Time> is in seconds and keeps increasing past midnight, only the time of day is logged
+# routing updates yield (<Time>, b'Routing Update', <Rows>) with the rows as one bytes block
+def parse_log(f_name):
+    now  = None
+    last = 0.0
+    day  = 0
+    for entry in iter_entries(f_name):
+        rest = entry.strip()
+        while rest:
+            line, _, rest = rest.partition(b'\n')
+            line = line.strip()
+            if line[:1].isdigit():
+                h, m, s = line.split(b':')
+                sec = int(h) * 3600 + int(m) * 60 + float(s)
+                if sec + day * DAY < last - DAY / 2:
+                    day += 1
+                now = last = sec + day * DAY
+            elif line == b'Routing Update':
+                rows, found, rest = rest.partition(b'Routing Complete')
+                if found:
+                    yield (now, b'Routing Update', rows)
+            elif line:
+                event, _, value = line.rpartition(b' ')
+                yield (now, event, value)
+
+# routes of a routing update as a set of (<Switch ID>, <Dest ID>, <Next Hop>), the rows are
+# split in one go, the controller rows have the distance as a fourth field that is left out
+FIELDS = bytes.maketrans(b',:', b'  ')
+def routes(rows, num_fields=3):
+    fields = rows.translate(FIELDS).split()
+    return frozenset(zip(fields[0::num_fields], fields[1::num_fields], fields[2::num_fields]))
+
+"""
+The RoutingState class is one routing update of the controller. The switch logs leave out the
+distances, so they are dropped from the controller rows, and rows repeated that way (i.e. the 9999
+rows added after a partition) count once, like in the sets of the switch tables. The raw rows are
+kept, an update with the same rows as the last one shares its routes instead of building them. A
+switch holds its part of the state when its routes are a subset of the state and it has as many
+routes as the state gives it, the routes per switch are only counted for states that events are
+measured against.
+"""
+class RoutingState():
+    def __init__(self, now, rows, prev=None):
+        self.time = now
+        self.rows = rows
+        self.routes = prev.routes if prev != None and rows == prev.rows else routes(rows, 4)
+        self._num_routes = None
+    def num_routes(self, sw_id):
+        if self._num_routes == None:
+            self._num_routes = Counter(map(itemgetter(0), self.routes))
+        return self._num_routes[sw_id]
+    def is_held(self, table, num_routes):
+        return table != None and len(table) == num_routes and table <= self.routes
+
+"""
+The SwitchTrack class follows the routing updates and neighbor events of one switch#.log. The log
+is only read as far as the analysis needs, and only the updates between the current routing state of
+the controller and the next one are kept in memory, updates from before the time the track was last
+advanced to are not kept.
+"""
+class SwitchTrack():
+    def __init__(self, sw_id, f_name):
+        self.id  = sw_id
+        self.key = str(sw_id).encode()
+        self._events  = parse_log(f_name)
+        self._read_to = float('-inf')
+        self._floor   = float('-inf')
+        self._updates = deque()
+        self.table = None
+        self.neighbor_dead = {}
+        self.num_updates   = 0
+        self.num_unchanged = 0
+        self._last_read    = None
+
+    # reads the log up to the first entry past time x, the routing
+    # updates are only kept for later if keep is set
+    def _fill(self, x, keep=True):
+        while self._read_to <= x:
+            entry = next(self._events, None)
+            if entry == None:
+                self._read_to = float('inf')
+                break
+            now, event, value = entry
+            self._read_to = now
+            if event == b'Routing Update':
+                table = routes(value)
+                self.num_updates += 1
+                if table == self._last_read:
+                    self.num_unchanged += 1
+                self._last_read = table
+                if not keep:
+                    pass
+                elif now <= self._floor:
+                    self.table = table
+                else:
+                    self._updates.append((now, table))
+            elif event == b'Neighbor Dead':
+                self.neighbor_dead.setdefault(value, deque()).append(now)
+
+    # moves self.table to the routing table the switch had at time x
+    def advance(self, x):
+        while self._updates and self._updates[0][0] <= x:
+            self.table = self._updates.popleft()[1]
+        self._floor = max(self._floor, x)
+        self._fill(x)
+
+    # first time in [start, horizon] at which the switch holds its part of the state
+    def first_match(self, state, num_routes, start, horizon):
+        self.advance(start)
+        if state.is_held(self.table, num_routes):
+            return start
+        self._fill(horizon)
+        for now, table in self._updates:
+            if now > horizon:
+                break
+            if state.is_held(table, num_routes):
+                return now
+        return None
+
+    # latest time in (x - window, x] at which the switch declared neighbor nb_id dead
+    def last_neighbor_dead(self, nb_id, x, window=DETECTION_WINDOW):
+        self._fill(x)
+        times = self.neighbor_dead.get(nb_id, ())
+        while len(times) > 1 and times[1] <= x:
+            times.popleft()
+        if times and x - window < times[0] <= x:
+            return times[0]
+        return None
+
+    # reads the rest of the log for the update counts
+    def drain(self):
+        self._updates.clear()
+        self._fill(float('inf'), keep=False)
+
+"""
+The Analyzer class walks the controller log once and correlates every Link Dead, Switch Dead and
+Switch Alive event with the switch logs. Events are attached to the next routing update of the
+controller, which converges once every switch it covers has applied its table. If the controller
+sends a newer update first, the events carry over to that one.
+"""
+class Analyzer():
+    def __init__(self, controller_log, switch_logs, window=DETECTION_WINDOW):
+        self.controller_log = controller_log
+        self.tracks  = {track.key: track for track in
+                        (SwitchTrack(sw_id, f_name) for sw_id, f_name in switch_logs.items())}
+        self.window  = window
+        self.detection   = {b'Link Dead':[], b'Switch Dead':[]}
+        self.convergence = {b'Link Dead':[], b'Switch Dead':[], b'Switch Alive':[]}
+        self.unconverged = 0
+        self.unmeasured  = 0
+        self.superseded  = 0
+        self.num_updates   = 0
+        self.num_unchanged = 0
+        self.routes_changed = []
+        self.first_time = None
+        self.last_time  = None
+
+    def run(self):
+        pending = []
+        state   = None
+        state_pending = []
+        for now, event, value in parse_log(self.controller_log):
+            if self.first_time == None:
+                self.first_time = now
+            self.last_time = now
+            if event == b'Routing Update':
+                new_state = RoutingState(now, value, state)
+                self._churn(state, new_state)
+                if state != None:
+                    pending = self._converge(state, state_pending, horizon=now) + pending
+                state, state_pending, pending = new_state, pending, []
+            elif event in self.convergence:
+                self._detect(now, event, value)
+                pending.append((now, event))
+        if state != None:
+            pending = self._converge(state, state_pending, horizon=float('inf')) + pending
+        self.unconverged += len(pending)
+        for track in self.tracks.values():
+            track.drain()
+        return self
+
+    def _detect(self, now, event, value):
+        if event == b'Link Dead':
+            sw_id, nb_id = value.split(b',')
+            track = self.tracks.get(sw_id)
+            found = track.last_neighbor_dead(nb_id, now, self.window) if track else None
+        elif event == b'Switch Dead':
+            found = [t for t in (track.last_neighbor_dead(value, now, self.window)
+                                 for track in self.tracks.values() if track.key != value) if t != None]
+            found = min(found) if found else None
+        else:
+            return
+        if found != None:
+            self.detection[event].append(now - found)
+
+    # returns the events that did not converge before the horizon, events of a
+    # state that no switch log covers are counted as unmeasured, states without
+    # events are not measured
+    # the switches are matched from the latest pending event on, earlier tables
+    # can equal the state (i.e. routes going back after a link recovers) but
+    # were superseded by the event that led to it
+    def _converge(self, state, pending, horizon):
+        if not pending:
+            return []
+        if not self.tracks:
+            self.unmeasured += len(pending)
+            return []
+        start = max([t for t, _ in pending], default=state.time)
+        converged = None
+        for track in self.tracks.values():
+            num_routes = state.num_routes(track.key)
+            if num_routes == 0:
+                continue
+            match = track.first_match(state, num_routes, start, horizon)
+            if match == None:
+                if horizon != float('inf'):
+                    self.superseded += 1
+                return pending
+            converged = max(start if converged == None else converged, match)
+        if converged == None:
+            self.unmeasured += len(pending)
+            return []
+        for t, event in pending:
+            self.convergence[event].append(converged - t)
+        return []
+
+    def _churn(self, old_state, new_state):
+        self.num_updates += 1
+        if old_state == None:
+            return
+        if new_state.routes is old_state.routes:
+            self.num_unchanged += 1
+            self.routes_changed.append(0)
+            return
+        if new_state.routes == old_state.routes:
+            self.num_unchanged += 1
+        self.routes_changed.append(len(new_state.routes - old_state.routes))
+
+    def report(self):
+        span = (self.last_time - self.first_time) if self.first_time != None else 0.0
+        return {
+            'span_seconds': span,
+            'detection_seconds':   {k.decode(): distribution(v) for k, v in self.detection.items()},
+            'convergence_seconds': {k.decode(): distribution(v) for k, v in self.convergence.items()},
+            'unconverged_events':  self.unconverged,
+            'unmeasured_events':   self.unmeasured,
+            'superseded_updates':  self.superseded,
+            'churn': {
+                'controller_updates':  self.num_updates,
+                'unchanged_updates':   self.num_unchanged,
+                'updates_per_minute':  60 * self.num_updates / span if span else None,
+                'routes_changed_per_update': distribution(self.routes_changed),
+                'switch_updates':   {t.id: t.num_updates for t in self.tracks.values()},
+                'switch_unchanged': {t.id: t.num_unchanged for t in self.tracks.values()},
+            },
+        }
+
+def distribution(values):
+    values = sorted(values)
+    if not values:
+        return {'count':0}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'count': len(values),
+            'min':   values[0],
+            'mean':  sum(values) / len(values),
+            'p50':   pick(0.50),
+            'p90':   pick(0.90),
+            'p99':   pick(0.99),
+            'max':   values[-1]}
+
+def print_report(report):
+    def fmt(dist):
+        if dist['count'] == 0:
+            return 'count=0'
+        return ' '.join(f'{k}={v:.6g}' if isinstance(v, float) else f'{k}={v}' for k, v in dist.items())
+    print(f"Span {report['span_seconds']:.3f}s")
+    print('Detection latency, first switch detection to controller event (s)')
+    for event, dist in report['detection_seconds'].items():
+        print(f'  {event}: {fmt(dist)}')
+    print('Convergence time, controller event to every switch on the new routes (s)')
+    for event, dist in report['convergence_seconds'].items():
+        print(f'  {event}: {fmt(dist)}')
+    print(f"  unconverged events: {report['unconverged_events']}")
+    print(f"  unmeasured events (no switch log): {report['unmeasured_events']}")
+    print(f"  superseded routing updates: {report['superseded_updates']}")
+    churn = report['churn']
+    print('Routing churn')
+    print(f"  controller updates: {churn['controller_updates']} ({churn['unchanged_updates']} unchanged)")
+    if churn['updates_per_minute'] != None:
+        print(f"  updates per minute: {churn['updates_per_minute']:.3f}")
+    print(f"  routes changed per update: {fmt(churn['routes_changed_per_update'])}")
+    for sw_id in sorted(churn['switch_updates']):
+        print(f"  switch {sw_id}: {churn['switch_updates'][sw_id]} updates "
+              f"({churn['switch_unchanged'][sw_id]} unchanged)")
+
+# finds Controller.log and switch#.log in a directory, or takes them as listed
+def find_logs(paths):
+    if len(paths) == 1 and os.path.isdir(paths[0]):
+        paths = [os.path.join(paths[0], 'Controller.log')] + [
+            os.path.join(paths[0], f_name) for f_name in sorted(os.listdir(paths[0]))
+            if re.fullmatch(r'switch\d+\.log', f_name)]
+    if not os.path.isfile(paths[0]):
+        raise ValueError(f'no such controller log: {paths[0]}')
+    switch_logs = {}
+    for f_name in paths[1:]:
+        match = re.search(r'switch(\d+)\.log$', f_name)
+        if match == None:
+            raise ValueError(f'switch log must be named switch#.log: {f_name}')
+        if not os.path.isfile(f_name):
+            raise ValueError(f'no such switch log: {f_name}')
+        switch_logs[int(match.group(1))] = f_name
+    return paths[0], switch_logs
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='log_analyzer.py',
+                        description='Convergence and control plane timing of Simple Software Defnined Netowrk (SDN) logs')
+    parser.add_argument('paths',
+                        nargs='+',
+                        help='directory holding Controller.log and switch#.log, or the controller log followed by the switch logs')
+    parser.add_argument('-w', '--window',
+                        type=float,
+                        default=DETECTION_WINDOW,
+                        help='seconds before a controller event in which a switch detection is matched to it')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args()
+
+    try:
+        controller_log, switch_logs = find_logs(args.paths)
+    except ValueError as e:
+        parser.error(str(e))
+    report = Analyzer(controller_log, switch_logs, args.window).run().report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,10 @@ import socket
 import threading 
 import json
 import copy
+import time
 
-from com import Listener, Sender, PING_TIME, TIMEOUT
+from com import Listener, Sender, PING_TIME, TIMEOUT, RTT_ALPHA
+from diag import Diagnostics
 
 # The log file for switches are switch#.log, where # is the id of that switch (i.e. switch0.log, switch1.log). 
 # The code for replacing # with a real number has been given to you in the main function.
@@ -22,6 +24,7 @@ class Neighbor():
         self.lock = threading.Lock()
         self.ping_age = datetime.now()
         self.ping_delta = timedelta(seconds=TIMEOUT)
+        self.srtt = None
         self._is_alive = True
     def __str__(self, blocking=True):
         if blocking: self.lock.acquire()
@@ -38,6 +41,14 @@ class Neighbor():
             is_alv = (datetime.now() - self.ping_age < self.ping_delta)
         return is_alv
 
+    # exponentially weighted moving average of the round trip time (seconds)
+    def update_rtt(self, sample):
+        assert self.lock.locked()
+        if self.srtt == None:
+            self.srtt = sample
+        else:
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * sample
+
 class Switch():
     def __init__(self, sw_id, host, port, failure_id, sender):
         self.id   = sw_id
@@ -54,6 +65,7 @@ class Switch():
         self.neighbors = dict()
         self.routing_table = []
         self.is_registered = False
+        self.diag = None
 
     def register(self):
         msg = {'action':'register_request', 'data':self.id}
@@ -67,9 +79,16 @@ class Switch():
         if self.is_registered == False:
             self.is_registered = True
             self.ping_age = datetime.now()
+        # known neighbors only move to the new address, so their smoothed RTT is kept
         for row in table:
             assert len(row) == 3
-            self.neighbors[row[0]] = Neighbor(*row)
+            nb_id, host, port = row
+            if nb_id in self.neighbors:
+                with self.neighbors[nb_id].lock:
+                    self.neighbors[nb_id].host = host
+                    self.neighbors[nb_id].port = port
+            else:
+                self.neighbors[nb_id] = Neighbor(nb_id, host, port)
         self.log_register_response_received()
 
     def handle_neighbor_dead(self, nb_id:int):
@@ -78,7 +97,7 @@ class Switch():
         print(f'DEAD: {self.id}->{nb_id}')
         self.log_neighbor_dead(nb_id)
 
-    def handle_alive_ping(self, nb_id:int, host, port):
+    def handle_alive_ping(self, nb_id:int, host, port, ts=None):
         assert self.lock.locked()
         if  nb_id != self.failure_id:
             if nb_id in self.neighbors:
@@ -88,6 +107,19 @@ class Switch():
                 print(f'ALIVE: {self.id}->{nb_id}')
                 self.neighbors[nb_id] = Neighbor(nb_id, host, port)
                 self.log_neighbor_alive(nb_id)
+            # echo the timestamp back so the neighbor can measure the RTT
+            if ts != None:
+                msg = {'action':'keep_alive_ack', 'data':{'id':self.id, 'ts':ts}}
+                self.sender.send_queue_append(
+                    (json.dumps(msg).encode(), (host, port)),
+                    front=True
+                )
+
+    def handle_alive_ack(self, nb_id:int, ts):
+        assert self.lock.locked()
+        if nb_id != self.failure_id and nb_id in self.neighbors:
+            with self.neighbors[nb_id].lock:
+                self.neighbors[nb_id].update_rtt(time.monotonic() - ts)
 
     def handle_routing_table_update(self, table):
         assert self.lock.locked()
@@ -97,7 +129,7 @@ class Switch():
     def do_alive_ping(self):
         for n in self.neighbors.values():
             if n.id != self.failure_id:
-                msg = {'action':'keep_alive', 'data':self.id}
+                msg = {'action':'keep_alive', 'data':{'id':self.id, 'ts':time.monotonic()}}
                 self.sender.send_queue_append(
                     (json.dumps(msg).encode(), (n.host, n.port)), 
                     front=True
@@ -107,6 +139,10 @@ class Switch():
         msg = {'action': 'topology_update', 
                'data':   {self.id:list(self.neighbors.keys())}
               }
+        # smoothed RTT (ms) of every neighbor that has answered a keep alive
+        rtt = {n.id:round(n.srtt * 1000, 3) for n in self.neighbors.values() if n.srtt != None}
+        if rtt:
+            msg['rtt'] = rtt
         self.sender.send_queue_append(
             (json.dumps(msg).encode(), (self.host, self.port)), 
         )
@@ -169,11 +205,20 @@ def handle_event(event, switch)->None:
             with switch.lock:
                 switch.handle_register_response(data['data']['table'])
         elif action == 'keep_alive':
+            # older switches send only their id without a timestamp
+            nb_id, ts = data['data'], None
+            if isinstance(nb_id, dict):
+                nb_id, ts = nb_id['id'], nb_id.get('ts')
+            with switch.lock:
+                switch.handle_alive_ping(nb_id, host, port, ts)
+        elif action == 'keep_alive_ack':
             with switch.lock:
-                switch.handle_alive_ping(data['data'], host, port)
+                switch.handle_alive_ack(data['data']['id'], data['data']['ts'])
         elif action == 'routing_update':
             with switch.lock:
                 switch.handle_routing_table_update(data['data'])
+        elif action == 'diag' and switch.diag != None:
+            switch.diag.request(data['data'])
         
     except Exception as e:
         if switch.lock.locked():
@@ -230,19 +275,31 @@ def main():
                         type=int,
                         default=None,
                         help='Uded for testing: The switch will run as usual, but the link to neighborID is killed to simulate failure')
+    parser.add_argument('-d', '--diag',
+                        action='store_true',
+                        help='enable profiling and diagnostics on SIGUSR1/SIGUSR2 and "diag" messages')
     args = parser.parse_args()
 
     LOG_FILE = 'switch' + str(args.id) + ".log" 
 
+    # locks are swapped for timed ones before any thread uses them
+    diag = Diagnostics('switch' + str(args.id)) if args.diag else None
+
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     print('\n\nStarting listener'.upper())
     listener = Listener(socket=sock)
+    if diag:
+        diag.instrument_lock(listener, '_event_queue_lock', 'listener')
+        diag.add_gauge('listener_queue', listener.event_queue_size)
     listener.start()
 
     print('\n\nStarting sender'.upper())
     sender = Sender(sock)
+    if diag:
+        diag.instrument_lock(sender, '_send_queue_lock', 'sender')
+        diag.add_gauge('sender_queue', sender.send_queue_size)
     sender.start()
 
     print('\n\nSenging register request to controller'.upper())
@@ -253,6 +310,11 @@ def main():
         args.neighborID, 
         sender
     )
+    if diag:
+        diag.instrument_lock(switch, 'lock', 'switch')
+        diag.add_gauge('neighbors', lambda: len(switch.neighbors))
+        diag.install_signal_handlers()
+        switch.diag = diag
     switch.register()
 
     success = loop_handle_events(switch, listener)
@@ -0,0 +1,155 @@
+import os
+import json
+from copy import deepcopy
+
+import pytest
+
+import area
+import controller as ctl
+
+CONFIG = os.path.join(os.path.dirname(__file__), 'Config', 'graph_6.txt')
+AREAS  = os.path.join(os.path.dirname(__file__), 'Config', 'areas_6.txt')
+
+class StubSender():
+    def __init__(self):
+        self.sent = []
+    def send_queue_append(self, event, front=False):
+        self.sent.append(event)
+
+# area 0 holds switches 0 1 5 and area 1 holds 2 3 4, the root is reached at ('root', 0)
+# and area <Area_ID> at ('area', <Area_ID>), messages are delivered by exchange()
+@pytest.fixture
+def fabric(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cfg   = ctl.read_config(CONFIG)
+    areas = area.read_areas(AREAS)
+    root  = area.RootController(StubSender())
+    ctls  = {a: area.AreaController(a, cfg, areas, ('root', 0), StubSender()) for a in areas}
+    for c in ctls.values():
+        with c.lock:
+            for sw_id in sorted(c.members):
+                c.handle_register_request('switch', 1000 + sw_id, sw_id)
+            c.bootstrapped_map = deepcopy(c.map)
+            c.is_booted = True
+            c.calc_routing_table_djk()
+        for sw_id in c.members:
+            report(c, sw_id)
+    exchange(root, ctls)
+    return root, ctls
+
+# topology_update of sw_id with all its configured neighbors alive, but the ones in down
+def report(c, sw_id, down=()):
+    neighbors = list(c.bootstrapped_map.get(sw_id, {})) + list(c.bootstrapped_border_map.get(sw_id, {}))
+    with c.lock:
+        c.handle_topology_update({str(sw_id): [nb_id for nb_id in neighbors if nb_id not in down]})
+
+def exchange(root, ctls):
+    for _ in range(3):
+        for area_id, c in ctls.items():
+            with c.lock:
+                c.send_summary()
+            for msg, addr in c._sender.sent:
+                data = json.loads(msg.decode())
+                if addr == ('root', 0):
+                    with root.lock:
+                        area.handle_root_action('area', area_id, data, root)
+            c._sender.sent.clear()
+        for msg, (_, area_id) in root._sender.sent:
+            c = ctls[area_id]
+            with c.lock:
+                area.handle_area_action('root', 0, json.loads(msg.decode()), c)
+        root._sender.sent.clear()
+
+def route(c, start, dest):
+    rows = [(next_hop, dist) for dest_id, next_hop, dist in c.routing_table[start] if dest_id == dest]
+    return min(rows, key=lambda row: row[1])
+
+def full_distances(dead=()):
+    cfg = ctl.read_config(CONFIG)
+    cfg['edges'] = [e for e in cfg['edges'] if e[0] not in dead and e[1] not in dead]
+    c = ctl.Controller(cfg, StubSender())
+    c.bootstrapped_map = deepcopy(c.map)
+    c.calc_routing_table_djk()
+    return {start: {dest: dist for dest, _, dist in rows} for start, rows in c.routing_table.items()}
+
+def test_stitched_routes_match_full_graph(fabric):
+    root, ctls = fabric
+    full = full_distances()
+    for c in ctls.values():
+        for start in c.members:
+            for dest in full[start]:
+                assert route(c, start, dest)[1] == full[start][dest]
+    assert route(ctls[0], 5, 3) == (2, 200)     # own border link
+    assert route(ctls[0], 0, 2) == (1, 150)     # through border switch 1
+    assert route(ctls[0], 0, 4) == (1, 280)
+    assert route(ctls[1], 3, 5) == (2, 200)     # through border switch 2
+
+def test_foreign_addresses_reach_border_switches(fabric):
+    root, ctls = fabric
+    c = ctls[0]
+    assert set(c.foreign_addresses) == {2, 3, 4}
+    with c.lock:
+        table = c.register_table(1)
+    assert {row[0] for row in table} == {0, 2, 4}
+
+def test_border_link_down(fabric):
+    root, ctls = fabric
+    report(ctls[0], 1, down=(2,))
+    report(ctls[1], 2, down=(1,))
+    exchange(root, ctls)
+    assert route(ctls[0], 0, 2) == (5, 230)
+    assert route(ctls[0], 1, 2) == (0, 330)
+    assert route(ctls[1], 2, 1) == (3, 330)
+
+def test_border_link_comes_back(fabric):
+    root, ctls = fabric
+    report(ctls[0], 1, down=(2,))
+    report(ctls[1], 2, down=(1,))
+    exchange(root, ctls)
+    report(ctls[0], 1)
+    report(ctls[1], 2)
+    exchange(root, ctls)
+    assert route(ctls[0], 0, 2) == (1, 150)
+
+def test_unknown_foreign_neighbor_is_not_dead(fabric):
+    root, ctls = fabric
+    c = ctls[0]
+    with c.lock:
+        c.handle_register_request('switch', 2001, 1)
+        c.handle_topology_update({'1': [0]})
+    assert c.border_map[1] == {}
+    report(c, 1)
+    assert c.border_map[1] == {2: 50, 4: 180}
+
+def test_foreign_switch_dead(fabric):
+    root, ctls = fabric
+    with ctls[1].lock:
+        ctls[1].handle_switch_dead(2)
+    for sw_id in (1, 5):
+        report(ctls[0], sw_id, down=(2,))
+    exchange(root, ctls)
+    full = full_distances(dead=(2,))
+    for start in ctls[0].members:
+        assert route(ctls[0], start, 2)[1] == ctls[0]._djk_max
+        for dest in (3, 4):
+            assert route(ctls[0], start, dest)[1] == full[start][dest]
+    assert route(ctls[0], 5, 4) == (0, 360)
+
+def test_partition_keeps_own_border_links(fabric):
+    root, ctls = fabric
+    c = ctls[0]
+    report(c, 0, down=(1,))
+    report(c, 1, down=(0,))
+    # until the root has the new summary, border 1 can not be used
+    assert route(c, 0, 3)[0] != 1
+    exchange(root, ctls)
+    assert route(c, 0, 3) == (3, 200)
+    assert route(c, 0, 2) == (5, 230)
+
+def test_unchanged_summary_is_answered(fabric):
+    root, ctls = fabric
+    with ctls[0].lock:
+        summary = ctls[0].build_summary()
+    with root.lock:
+        area.handle_root_action('area', 0, json.loads(json.dumps({'action':'area_summary', 'data':summary})), root)
+    assert [addr for _, addr in root._sender.sent] == [('area', 0)]
@@ -0,0 +1,96 @@
+import pytest
+
+import log_analyzer as la
+
+# writes a log the way the controller and the switches do, every entry as
+# "\n\n<Timestamp>\n<Lines>", with the timestamps given as seconds of the day
+def write_log(path, entries):
+    with open(path, 'w') as log_file:
+        for sec, lines in entries:
+            h, rest = divmod(sec, 3600)
+            m, s = divmod(rest, 60)
+            log_file.write(f'\n\n{int(h):02d}:{int(m):02d}:{s:09.6f}\n')
+            log_file.writelines(line + '\n' for line in lines)
+    return str(path)
+
+def update(*rows):
+    return ['Routing Update', *rows, 'Routing Complete']
+
+# controller with switches 0 and 1, where the link 0-1 goes down and comes back
+UP   = update('0,0:0,0', '0,1:1,10', '1,0:0,10', '1,1:1,0')
+DOWN = update('0,0:0,0', '0,1:-1,9999', '1,0:-1,9999', '1,1:1,0', '0,0:0,9999', '1,1:1,9999')
+
+def analyze(tmp_path, controller, switches={}):
+    switch_logs = {sw_id: write_log(tmp_path / f'switch{sw_id}.log', entries) for sw_id, entries in switches.items()}
+    return la.Analyzer(write_log(tmp_path / 'Controller.log', controller), switch_logs).run()
+
+def test_parse_log_rolls_over_midnight(tmp_path):
+    f_name = write_log(tmp_path / 'Controller.log', [
+        (86399.5, ['Link Dead 0,1']),
+        (86399.4, ['Switch Dead 2']),       # logged out of order, same day
+        (0.5,     ['Switch Alive 2']),
+        (1.0,     update('0,0:0,0')),
+    ])
+    assert [(now, event) for now, event, _ in la.parse_log(f_name)] == [
+        (86399.5, b'Link Dead'), (86399.4, b'Switch Dead'),
+        (86400.5, b'Switch Alive'), (86401.0, b'Routing Update')]
+
+def test_routing_state_drops_distances_and_repeated_rows():
+    state = la.RoutingState(0.0, b'\n'.join(line.encode() for line in DOWN[1:-1]))
+    assert state.num_routes(b'0') == 2
+    assert state.num_routes(b'1') == 2
+    assert state.is_held(la.routes(b'0,0:0\n0,1:-1\n'), 2)
+    assert not state.is_held(la.routes(b'0,0:0\n0,1:1\n'), 2)
+
+def test_unchanged_update_shares_routes(tmp_path):
+    rows  = b'0,0:0,0\n0,1:1,10\n'
+    state = la.RoutingState(0.0, rows)
+    assert la.RoutingState(1.0, bytes(rows), state).routes is state.routes
+    analyzer = analyze(tmp_path, [(1.0, UP), (2.0, UP), (3.0, DOWN)])
+    assert analyzer.num_updates == 3
+    assert analyzer.num_unchanged == 1
+    assert analyzer.routes_changed == [0, 2]
+
+def test_events_carry_over_superseded_update(tmp_path):
+    analyzer = analyze(tmp_path, [
+        (1.0,  UP),
+        (10.0, ['Link Dead 0,1']),
+        (11.0, DOWN),
+        (12.0, ['Link Dead 1,0']),
+        (13.0, update('0,0:0,0', '0,1:-1,9999', '1,0:-1,9999', '1,1:1,0')),
+    ], {0: [(1.5, update('0,0:0', '0,1:1')), (13.5, update('0,0:0', '0,1:-1'))]})
+    # switch 0 never applied the update of 11.0, its event waits for the update of 13.0
+    assert analyzer.superseded == 1
+    assert analyzer.convergence[b'Link Dead'] == [3.5, 1.5]
+    assert analyzer.unconverged == 0
+
+def test_carried_event_does_not_match_older_table(tmp_path):
+    analyzer = analyze(tmp_path, [
+        (1.0,  UP),
+        (10.0, ['Link Dead 0,1']),
+        (11.0, DOWN),
+        (20.0, ['Switch Alive 1']),
+        (21.0, UP),
+    ], {0: [(1.5, update('0,0:0', '0,1:1')), (21.5, update('0,0:0', '0,1:1'))]})
+    # switch 0 kept the routes of 1.0, which equal the update of 21.0, they are
+    # only matched from the latest event on
+    assert analyzer.superseded == 1
+    assert analyzer.convergence[b'Link Dead'] == [10.0]
+    assert analyzer.convergence[b'Switch Alive'] == [0.0]
+
+def test_events_without_switch_logs_are_unmeasured(tmp_path):
+    analyzer = analyze(tmp_path, [(1.0, UP), (10.0, ['Link Dead 0,1']), (11.0, DOWN)])
+    assert analyzer.unmeasured == 1
+    assert analyzer.convergence[b'Link Dead'] == []
+    assert analyzer.unconverged == 0
+
+def test_find_logs_checks_paths(tmp_path):
+    controller = write_log(tmp_path / 'Controller.log', [])
+    switch = write_log(tmp_path / 'switch3.log', [])
+    assert la.find_logs([str(tmp_path)]) == (controller, {3: switch})
+    with pytest.raises(ValueError, match='no such controller log'):
+        la.find_logs([str(tmp_path / 'missing')])
+    with pytest.raises(ValueError, match='no such switch log'):
+        la.find_logs([controller, str(tmp_path / 'switch4.log')])
+    with pytest.raises(ValueError, match='switch#.log'):
+        la.find_logs([controller, switch + '.old'])